@@ -1,9 +1,7 @@
 # app.py
 import streamlit as st
-from omr_preprocessing import preprocess_omr
-from omr_bubble_detection import extract_bubbles
-from omr_scoring import calculate_score
-from db_setup import init_db, save_results, get_all_results
+from omr_scoring import calculate_score, calculate_score_debug, convert_answer_key_letters
+from db_setup import init_db, finalize_indexes, save_results_bulk, get_results_dataframe
 import pandas as pd
 import numpy as np
 import plotly.express as px
@@ -11,14 +9,30 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
 
+import hashlib
+import io
 import re
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Chart colors shared by every builder
+PALETTE = ('#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD', '#98D8C8')
+SUBJECT_RANGE_COLORS = ('#FF6B6B', '#FFA07A', '#98D8C8', '#4ECDC4')
+TOTAL_RANGE_COLORS = ('#FF6B6B', '#FFA07A', '#FFD93D', '#4ECDC4')
+
+# Filename patterns, compiled once rather than looked up on every rerun
+SPECIAL_CHARS_RE = re.compile(r'[^\w\s-]')
+SEPARATORS_RE = re.compile(r'[\s_]+')
+INVALID_FILENAME_RE = re.compile(r'[^\w\s.-]')
 
 # Add at the top after imports
+@st.cache_resource(show_spinner=False)
 def get_deployment_info():
     """
     Detect deployment platform and return relevant info
+    Environment variables are fixed for the process, so this runs once rather than on every rerun
     """
     if "STREAMLIT_CLOUD" in os.environ or "streamlit.io" in os.environ.get("STREAMLIT_SERVER_ADDRESS", ""):
         return "Streamlit Cloud"
@@ -43,9 +57,9 @@ def sanitize_filename(filename):
     
     # Remove special characters and replace with underscores
     name, ext = os.path.splitext(filename)
-    name = re.sub(r'[^\w\s-]', '_', name)
+    name = SPECIAL_CHARS_RE.sub('_', name)
     # Replace multiple spaces/underscores with single underscore
-    name = re.sub(r'[\s_]+', '_', name)
+    name = SEPARATORS_RE.sub('_', name)
     # Convert to lowercase
     name = name.lower()
     # Remove leading/trailing underscores
@@ -66,7 +80,7 @@ def validate_filename(filename):
         suggestions.append("💡 Remove the extra extension")
     
     # Check for special characters
-    if re.search(r'[^\w\s.-]', filename):
+    if INVALID_FILENAME_RE.search(filename):
         issues.append("❌ Special characters in filename")
         suggestions.append("💡 Use only letters, numbers, spaces, dots, and hyphens")
     
@@ -77,19 +91,180 @@ def validate_filename(filename):
     
     return issues, suggestions
 
+def clean_answer_column(col):
+    """
+    Clean one answer-key column with vectorized string ops (e.g. "1 - a" -> "a")
+    Empty cells stay NaN so they can be dropped after flattening
+    """
+    text = col.dropna().astype(str).str.strip()
+    has_choice = text.str.contains(' - ', regex=False)
+    cleaned = text.where(~has_choice, text.str.split(' - ').str.get(1)).str.strip()
+    return cleaned.reindex(col.index)
+
+def downcast_scores(df, score_cols):
+    """
+    Shrink integer score columns to the smallest dtype that holds them (less data to send to the browser)
+    """
+    for col in score_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+@st.cache_data(show_spinner=False)
+def read_answer_key_excel(file_bytes):
+    """
+    Parse the answer key Excel file, memoized on the uploaded bytes so reruns skip the parse
+    """
+    try:
+        # Rust-backed streaming parser (needs pandas >= 2.2 and python-calamine)
+        df_key = pd.read_excel(io.BytesIO(file_bytes), header=0, engine='calamine')
+    except Exception:
+        # Missing engine or a file calamine rejects: retry with openpyxl
+        df_key = pd.read_excel(io.BytesIO(file_bytes), header=0, engine='openpyxl')
+    
+    # Fully blank rows (e.g. trailing formatted cells) are not questions
+    return df_key.dropna(how='all')
+
+@st.cache_data(show_spinner=False)
+def load_answer_key(file_bytes):
+    """
+    Parse and flatten the answer key into subject-major order, memoized on the uploaded bytes
+    Returns (answer_key_flat, subject_names)
+    """
+    df_key = read_answer_key_excel(file_bytes)
+    subject_names = [str(col) for col in df_key.columns.tolist()]
+    
+    # Transposing before ravel keeps subject-major order; empty cells are dropped
+    cleaned_key = df_key.apply(clean_answer_column).to_numpy(dtype=object).T.ravel()
+    answer_key_flat = cleaned_key[pd.notna(cleaned_key)].tolist()
+    return answer_key_flat, subject_names
+
+@st.cache_data(show_spinner=False)
+def dataframe_to_csv_bytes(df_hash, _df):
+    """
+    Serialize a results table to CSV once per content hash; the frame itself is not hashed
+    """
+    return _df.to_csv(index=False).encode()
+
+def hash_image(img):
+    """
+    Hash the full pixel buffer (Streamlit samples large arrays, which could collide)
+    """
+    return hashlib.blake2b(img.tobytes(), digest_size=16).digest() + str(img.shape).encode()
+
+def hash_dataframe(df):
+    """
+    Hash every row plus the column labels, used as the cache key for chart builders
+    """
+    return pd.util.hash_pandas_object(df, index=True).values.tobytes() + str(list(df.columns)).encode()
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_preprocess_omr(image_bytes):
+    """
+    preprocess_omr memoized on the image bytes, so re-evaluating the same sheets is a cache hit
+    Returns (thresh_img, preview_jpeg) where the preview is a downscaled grayscale copy of the original for display
+    """
+    # Decode once in the worker, straight to the single channel the pipeline works on
+    img = decode_image(image_bytes, grayscale=True)
+    
+    # A small JPEG preview keeps the full-resolution photo off the websocket
+    return preprocess_omr(img), encode_preview(img)
+
+@st.cache_data(max_entries=256, show_spinner=False, hash_funcs={np.ndarray: hash_image})
+def cached_extract_bubbles(thresh_img, num_subjects, questions_per_subject, choices_per_question):
+    """
+    extract_bubbles memoized on the thresholded image and sheet layout
+    """
+    return extract_bubbles(
+        thresh_img,
+        num_subjects=num_subjects,
+        questions_per_subject=questions_per_subject,
+        choices_per_question=choices_per_question
+    )
+
+def process_sheet(image_bytes, answer_key, num_subjects, questions_per_subject, debug=False):
+    """
+    Run the OMR pipeline for one sheet without any Streamlit UI calls, so it can run in a worker thread
+    Returns (thresh_img, thresh_preview, original_preview, student_answers, subject_scores, total_score)
+    """
+    # Preprocess image
+    thresh_img, original_preview = cached_preprocess_omr(image_bytes)
+    thresh_preview = resize_for_display(thresh_img)
+    
+    # Extract bubbles (debug runs bypass the cache so the diagnostics get printed)
+    if debug:
+        student_answers = extract_bubbles(
+            thresh_img,
+            num_subjects=num_subjects,
+            questions_per_subject=questions_per_subject,
+            choices_per_question=4,  # A, B, C, D for Innomatics sheets
+            debug=debug
+        )
+    else:
+        student_answers = cached_extract_bubbles(thresh_img, num_subjects, questions_per_subject, 4)
+    
+    # Calculate scores (debug runs also print the per-subject breakdown)
+    score_sheet = calculate_score_debug if debug else calculate_score
+    subject_scores, total_score = score_sheet(
+        student_answers, 
+        answer_key,
+        num_subjects=num_subjects,
+        questions_per_subject=questions_per_subject
+    )
+    
+    return thresh_img, thresh_preview, original_preview, student_answers, subject_scores, total_score
+
+def count_score_ranges(scores, bins):
+    """
+    Count scores per range using the same edges as pd.cut(..., include_lowest=True)
+    Missing and out-of-range scores are left out; counts come back in range order
+    A 2D (students x subjects) input is counted per column in one pass
+    """
+    values = np.asarray(scores, dtype=float)
+    columns = values if values.ndim > 1 else values[:, None]
+    num_ranges = len(bins) - 1
+    
+    # Offset each column's range index so a single bincount covers every column
+    in_range = (columns >= bins[0]) & (columns <= bins[-1])
+    range_idx = np.digitize(columns, bins[1:-1], right=True) + np.arange(columns.shape[1]) * num_ranges
+    counts = np.bincount(range_idx[in_range], minlength=columns.shape[1] * num_ranges)
+    
+    if values.ndim > 1:
+        return counts.reshape(columns.shape[1], num_ranges)
+    return counts
+
+def pie_percent_text(values):
+    """
+    Slice percentages formatted in Python, so Plotly does not have to compute them in the browser
+    """
+    values = np.asarray(values, dtype=float)
+    total = values.sum()
+    shares = values / total if total else np.zeros_like(values)
+    return [f'{share:.1%}' for share in shares]
+
+@st.cache_data(show_spinner=False)
 def create_donut_chart(data, title, colors=None):
     """
     Create a beautiful donut chart with custom styling
+    Returned as a figure dict so reruns with the same data reuse the cached spec
     """
     if colors is None:
-        colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD', '#98D8C8']
+        colors = PALETTE
+    
+    # Label, value and percent lines precomputed (same content as textinfo='label+value+percent')
+    slice_text = [
+        f'{label}<br>{value}<br>{percent}'
+        for label, value, percent in zip(data.index, data.values, pie_percent_text(data.values))
+    ]
     
     fig = go.Figure(data=[go.Pie(
         labels=data.index, 
         values=data.values,
         hole=0.5,
-        marker_colors=colors[:len(data)],
-        textinfo='label+percent+value',
+        marker_colors=list(colors[:len(data)]),
+        text=slice_text,
+        textinfo='text',
+        hovertemplate='%{text}<extra></extra>',
         textfont_size=12,
         marker=dict(line=dict(color='#FFFFFF', width=2))
     )])
@@ -113,16 +288,22 @@ def create_donut_chart(data, title, colors=None):
         font=dict(size=11)
     )
     
-    return fig
+    return fig.to_dict()
 
 
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
 def create_subject_wise_donut_charts(df, subject_names):
     """
     Create individual donut charts for each subject showing score distribution
     """
+    # Nothing to plot: skip building the subplot grid
+    present = [subject for subject in subject_names if subject in df.columns]
+    if df.empty or not present:
+        return None
+    
     # Calculate score ranges for better visualization
     score_ranges = ['0-5', '6-10', '11-15', '16-20']
-    colors = ['#FF6B6B', '#FFA07A', '#98D8C8', '#4ECDC4']
+    bins = np.array([0, 5, 10, 15, 20])
     
     # Create subplots
     cols = min(3, len(subject_names))
@@ -136,28 +317,25 @@ def create_subject_wise_donut_charts(df, subject_names):
         horizontal_spacing=0.1
     )
     
+    # Categorize every subject's scores into ranges at once (kept in range order so colors stay fixed per range)
+    subject_counts = dict(zip(present, count_score_ranges(df[present].to_numpy(), bins)))
+    
     for idx, subject in enumerate(subject_names):
-        if subject in df.columns:
-            scores = df[subject]
-            
-            # Categorize scores into ranges
-            score_distribution = pd.cut(
-                scores, 
-                bins=[0, 5, 10, 15, 20], 
-                labels=score_ranges, 
-                include_lowest=True
-            ).value_counts()
+        if subject in subject_counts:
+            range_counts = subject_counts[subject]
             
             row = idx // cols + 1
             col = idx % cols + 1
             
             fig.add_trace(
                 go.Pie(
-                    labels=score_distribution.index,
-                    values=score_distribution.values,
+                    labels=score_ranges,
+                    values=range_counts,
                     hole=0.4,
-                    marker_colors=colors,
-                    textinfo='percent',
+                    marker_colors=list(SUBJECT_RANGE_COLORS),
+                    text=pie_percent_text(range_counts),
+                    textinfo='text',
+                    hovertemplate='%{label}: %{value} (%{text})<extra></extra>',
                     textfont_size=10,
                     name=subject
                 ),
@@ -175,9 +353,68 @@ def create_subject_wise_donut_charts(df, subject_names):
         font=dict(size=10)
     )
     
-    return fig
+    return fig.to_dict()
 
 
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
+def create_student_donut_charts(df, subject_names):
+    """
+    One donut per student showing their subject scores, all in a single figure
+    """
+    present = [subject for subject in subject_names if subject in df.columns]
+    if df.empty or not present:
+        return None
+    
+    student_names = df['Student'].astype(str).tolist()
+    
+    # Create subplots
+    cols = min(3, len(student_names))
+    rows = (len(student_names) + cols - 1) // cols
+    
+    fig = make_subplots(
+        rows=rows, cols=cols,
+        specs=[[{"type": "domain"}] * cols for _ in range(rows)],
+        subplot_titles=[f"{name}'s Subject Scores" for name in student_names],
+        vertical_spacing=0.1,
+        horizontal_spacing=0.1
+    )
+    
+    for idx, (name, scores) in enumerate(zip(student_names, df[present].to_numpy())):
+        slice_text = [
+            f'{subject}<br>{score}<br>{percent}'
+            for subject, score, percent in zip(present, scores, pie_percent_text(scores))
+        ]
+        fig.add_trace(
+            go.Pie(
+                labels=present,
+                values=scores,
+                hole=0.5,
+                marker_colors=list(PALETTE[:len(present)]),
+                text=slice_text,
+                textinfo='text',
+                hovertemplate='%{text}<extra></extra>',
+                textfont_size=11,
+                marker=dict(line=dict(color='#FFFFFF', width=2)),
+                name=name
+            ),
+            row=idx // cols + 1, col=idx % cols + 1
+        )
+    
+    fig.update_layout(
+        title=dict(
+            text="📊 Individual Subject Scores",
+            x=0.5,
+            font=dict(size=20, color='#2E86C1')
+        ),
+        height=350 * rows,
+        showlegend=True,
+        font=dict(size=11)
+    )
+    
+    return fig.to_dict()
+
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
 def create_overall_performance_chart(df, subject_names):
     """
     Create overall performance visualization
@@ -190,43 +427,36 @@ def create_overall_performance_chart(df, subject_names):
     
     # Create score ranges for total (0-100)
     score_ranges = ['0-25', '26-50', '51-75', '76-100']
-    colors = ['#FF6B6B', '#FFA07A', '#FFD93D', '#4ECDC4']
     
-    total_distribution = pd.cut(
-        total_scores,
-        bins=[0, 25, 50, 75, 100],
-        labels=score_ranges,
-        include_lowest=True
-    ).value_counts()
+    # One vectorized pass; np.histogram would put boundary scores (25, 50, 75) in the upper range
+    range_counts = count_score_ranges(total_scores.to_numpy(), np.array([0, 25, 50, 75, 100]))
+    total_distribution = pd.Series(range_counts, index=score_ranges)
     
     fig = create_donut_chart(
         total_distribution,
         "🎯 Overall Performance Distribution (Total Scores)",
-        colors
+        TOTAL_RANGE_COLORS
     )
     
     return fig
 
 
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
 def create_subject_averages_chart(df, subject_names):
     """
     Create a bar chart showing average scores per subject
     """
-    if df.empty:
+    if df.empty or not any(subject in df.columns for subject in subject_names):
         return None
     
-    averages = []
-    for subject in subject_names:
-        if subject in df.columns:
-            averages.append(df[subject].mean())
-        else:
-            averages.append(0)
+    # All subject means in one reduction; subjects missing from df plot as 0
+    averages = df.reindex(columns=subject_names, fill_value=0).mean(numeric_only=True).reindex(subject_names).fillna(0).to_numpy()
     
     fig = go.Figure(data=[
         go.Bar(
             x=subject_names,
             y=averages,
-            marker_color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7'],
+            marker_color=list(PALETTE[:5]),
             text=[f'{avg:.1f}' for avg in averages],
             textposition='auto',
         )
@@ -245,7 +475,7 @@ def create_subject_averages_chart(df, subject_names):
         margin=dict(t=50, b=50, l=50, r=50)
     )
     
-    return fig
+    return fig.to_dict()
 
 
 def create_performance_metrics_cards(df, subject_names):
@@ -257,9 +487,13 @@ def create_performance_metrics_cards(df, subject_names):
     
     # Calculate metrics
     total_students = len(df)
-    avg_total = df['Total'].mean() if 'Total' in df.columns else 0
-    max_score = df['Total'].max() if 'Total' in df.columns else 0
-    min_score = df['Total'].min() if 'Total' in df.columns else 0
+    if 'Total' in df.columns:
+        # NumPy reductions on the raw column; integer totals keep their dtype so they display without decimals
+        totals = df['Total'].to_numpy()
+        avg_total = float(np.nanmean(totals))
+        max_score, min_score = np.nanmax(totals), np.nanmin(totals)
+    else:
+        avg_total = max_score = min_score = 0
     
     # Create columns for metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -296,7 +530,9 @@ def create_performance_metrics_cards(df, subject_names):
 st.set_page_config(page_title="OMR Evaluation System", layout="wide", initial_sidebar_state="expanded")
 
 # Custom CSS for better styling
-st.markdown("""
+# Emitted on every run on purpose: Streamlit drops elements a rerun does not re-emit,
+# so a run-once guard would strip the styling after the first interaction
+CUSTOM_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -329,7 +565,8 @@ st.markdown("""
         margin: 1rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 st.markdown('<h1 class="main-header">🎯 Automated OMR Evaluation System</h1>', unsafe_allow_html=True)
 
@@ -338,8 +575,14 @@ if 'answer_key_loaded' not in st.session_state:
     st.session_state.answer_key_loaded = False
 if 'answer_key' not in st.session_state:
     st.session_state.answer_key = None
+if 'answer_key_np' not in st.session_state:
+    st.session_state.answer_key_np = None
 if 'subject_names' not in st.session_state:
     st.session_state.subject_names = []
+if 'num_subjects' not in st.session_state:
+    st.session_state.num_subjects = 0
+if 'questions_per_subject' not in st.session_state:
+    st.session_state.questions_per_subject = 0
 if 'results_cache' not in st.session_state:
     st.session_state.results_cache = []
 
@@ -444,24 +687,18 @@ with col1:
         
         try:
             # Try to read the Excel file with better error handling
+            key_bytes = answer_file.getvalue()
             with st.spinner("📊 Processing Excel file..."):
                 try:
-                    # Method 1: Direct pandas read
-                    df_key = pd.read_excel(answer_file, header=0, engine='openpyxl')
-                except Exception as e1:
-                    st.warning(f"⚠️ First attempt failed: {str(e1)}")
-                    try:
-                        # Method 2: Reset file pointer and try again
-                        answer_file.seek(0)
-                        file_bytes = answer_file.read()
-                        df_key = pd.read_excel(pd.io.common.BytesIO(file_bytes), header=0, engine='openpyxl')
-                    except Exception as e2:
-                        st.error(f"❌ Failed to read Excel file: {str(e2)}")
-                        st.error("💡 **Troubleshooting tips:**")
-                        st.error("1. Try renaming your file to remove special characters: `answer_key.xlsx`")
-                        st.error("2. Ensure file is a valid Excel format (.xlsx or .xls)")
-                        st.error("3. Try saving the file again in Excel")
-                        st.stop()
+                    # Cached read keyed on the file contents (falls back to openpyxl internally)
+                    df_key = read_answer_key_excel(key_bytes)
+                except Exception as e:
+                    st.error(f"❌ Failed to read Excel file: {str(e)}")
+                    st.error("💡 **Troubleshooting tips:**")
+                    st.error("1. Try renaming your file to remove special characters: `answer_key.xlsx`")
+                    st.error("2. Ensure file is a valid Excel format (.xlsx or .xls)")
+                    st.error("3. Try saving the file again in Excel")
+                    st.stop()
             
             # Validate Excel structure
             if df_key.empty:
@@ -476,52 +713,44 @@ with col1:
             st.success("✅ Excel file read successfully!")
             
             # Show the structure of uploaded file
-            st.write("**📊 Answer Key Preview:**")
-            st.dataframe(df_key.head(), use_container_width=True)
-            
-            # Get subject names and structure the answer key properly
-            subject_names = [str(col) for col in df_key.columns.tolist()]
+            with st.expander("📊 Answer Key Preview", expanded=False):
+                st.dataframe(df_key.head(), use_container_width=True)
             
             # The Excel structure shows each column is a subject with 20 answers
             questions_per_subject = len(df_key)
             
             # Flatten the answer key properly - each column represents a subject
-            answer_key_flat = []
-            for subject_col in df_key.columns:
-                subject_answers = df_key[subject_col].dropna().tolist()
-                # Clean and convert each answer
-                clean_answers = []
-                for ans in subject_answers:
-                    if isinstance(ans, str):
-                        # Extract just the letter part (e.g., "1 - a" -> "a")
-                        parts = ans.strip().split(' - ')
-                        if len(parts) >= 2:
-                            clean_answers.append(parts[1].strip())
-                        else:
-                            clean_answers.append(ans.strip())
-                    else:
-                        clean_answers.append(str(ans))
-                answer_key_flat.extend(clean_answers)
+            answer_key_flat, subject_names = load_answer_key(key_bytes)
             
             st.session_state.answer_key = answer_key_flat
+            # Numeric copy of the key, converted once for vectorized scoring
+            st.session_state.answer_key_np = np.asarray(convert_answer_key_letters(answer_key_flat), dtype=np.int8)
             st.session_state.subject_names = subject_names
+            # Sheet layout used by the evaluation loop, derived once from the flattened key
+            st.session_state.num_subjects = len(subject_names)
+            st.session_state.questions_per_subject = len(answer_key_flat) // len(subject_names)
             st.session_state.answer_key_loaded = True
             
             st.markdown('<div class="success-box">✅ Answer key loaded successfully!</div>', unsafe_allow_html=True)
-            st.info(f"**Subjects:** {', '.join(subject_names)}")
-            st.info(f"**Questions per subject:** {questions_per_subject}")
-            st.info(f"**Total questions:** {len(answer_key_flat)}")
+            if debug_mode:
+                st.info(f"**Subjects:** {', '.join(subject_names)}")
+                st.info(f"**Questions per subject:** {questions_per_subject}")
+                st.info(f"**Total questions:** {len(answer_key_flat)}")
             
             # Initialize database with better error handling
-            try:
-                db_success = init_db(subject_names)
-                if db_success:
-                    st.success("✅ Database initialized successfully!")
-                else:
-                    st.warning("⚠️ Database initialization failed, using session storage")
-            except Exception as e:
-                st.warning(f"⚠️ Database error: {str(e)}")
-                st.info("💡 Using session storage as fallback")
+            # init_db recreates the results table, so only run it when the subject layout changes
+            if st.session_state.get('db_subjects') != tuple(subject_names):
+                try:
+                    # Indexes are built after the first batch is saved
+                    db_success = init_db(subject_names, defer_indexes=True)
+                    if db_success:
+                        st.session_state.db_subjects = tuple(subject_names)
+                        st.success("✅ Database initialized successfully!")
+                    else:
+                        st.warning("⚠️ Database initialization failed, using session storage")
+                except Exception as e:
+                    st.warning(f"⚠️ Database error: {str(e)}")
+                    st.info("💡 Using session storage as fallback")
             
             if debug_mode:
                 st.write("**🔍 Debug - Answer Key Sample:**", answer_key_flat[:10])
@@ -578,112 +807,147 @@ if st.button("🚀 Start Evaluation", type="primary", use_container_width=True):
     elif not uploaded_files:
         st.error("❌ Please upload at least one OMR sheet!")
     else:
+        # OpenCV-backed pipeline modules are only needed once an evaluation starts
+        from omr_preprocessing import decode_image, encode_preview, preprocess_omr, resize_for_display
+        from omr_bubble_detection import extract_bubbles
+        
         # Create progress bar
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        all_results = []
+        pending_rows = []
         total_files = len(uploaded_files)
+        last_pct = -100
+        
+        # Loop invariants: read session state once per evaluation run
+        subject_names = st.session_state.subject_names
+        answer_key = st.session_state.answer_key_np
+        num_subjects = st.session_state.num_subjects
+        questions_per_subject = st.session_state.questions_per_subject
+        
+        # Preallocated per-column arrays, one row per sheet; rows of failed sheets are masked out
+        score_matrix = np.zeros((total_files, num_subjects), dtype=np.int16)
+        totals = np.zeros(total_files, dtype=np.int16)
+        student_names = [None] * total_files
+        evaluated = np.zeros(total_files, dtype=bool)
+        
+        # Read each upload once; workers decode it and build the display previews
+        sheet_bytes = [uploaded_file.getvalue() for uploaded_file in uploaded_files]
         
-        for idx, uploaded_file in enumerate(uploaded_files):
-            status_text.text(f"Processing sheet {idx + 1} of {total_files}...")
-            progress_bar.progress((idx) / total_files)
+        # OpenCV/NumPy release the GIL, so sheets are processed concurrently;
+        # results are rendered here on the main thread in upload order
+        # Workers share this run's script context so the cached pipeline steps work off the main thread
+        with ThreadPoolExecutor(
+            max_workers=os.cpu_count(),
+            initializer=add_script_run_ctx,
+            initargs=(None, get_script_run_ctx())
+        ) as executor:
+            futures = [
+                executor.submit(
+                    process_sheet,
+                    image_bytes,
+                    answer_key,
+                    num_subjects,
+                    questions_per_subject,
+                    debug_mode
+                )
+                for image_bytes in sheet_bytes
+            ]
             
-            # Create columns for each sheet
-            with st.expander(f"📋 Sheet {idx + 1} - {uploaded_file.name}", expanded=(idx == 0)):
-                sheet_col1, sheet_col2 = st.columns([1, 1])
+            for idx, (uploaded_file, future) in enumerate(zip(uploaded_files, futures)):
+                # Integer percent, redrawn only every 5% to limit websocket traffic
+                pct = 100 * idx // total_files
+                if pct - last_pct >= 5:
+                    status_text.text(f"Processing sheet {idx + 1} of {total_files}...")
+                    progress_bar.progress(pct)
+                    last_pct = pct
                 
-                try:
-                    with sheet_col1:
-                        st.image(uploaded_file, caption=f"Original Sheet {idx+1}", use_container_width=True)
-                    
-                    # Reset file pointer
-                    uploaded_file.seek(0)
-                    
-                    # Preprocess image
-                    thresh_img = preprocess_omr(uploaded_file)
-                    
-                    with sheet_col2:
-                        st.image(thresh_img, caption="Processed Image", use_container_width=True)
-                    
-                    # Extract bubbles
-                    student_answers = extract_bubbles(
-                        thresh_img,
-                        num_subjects=len(st.session_state.subject_names),
-                        questions_per_subject=len(st.session_state.answer_key) // len(st.session_state.subject_names),
-                        choices_per_question=4,  # A, B, C, D for Innomatics sheets
-                        debug=debug_mode
-                    )
-                    
-                    # Calculate scores
-                    subject_scores, total_score = calculate_score(
-                        student_answers, 
-                        st.session_state.answer_key,
-                        num_subjects=len(st.session_state.subject_names),
-                        questions_per_subject=len(st.session_state.answer_key) // len(st.session_state.subject_names),
-                        debug=debug_mode
-                    )
-                    
-                    # Determine student name
-                    if student_name_input.strip():
-                        student_name = f"{student_name_input}_{idx+1}" if total_files > 1 else student_name_input
-                    else:
-                        student_name = f"Student_{idx+1}"
+                # Create columns for each sheet
+                with st.expander(f"📋 Sheet {idx + 1} - {uploaded_file.name}", expanded=(idx == 0)):
+                    sheet_col1, sheet_col2 = st.columns([1, 1])
                     
-                    # Save to database
-                    save_results(student_name, subject_scores, total_score, st.session_state.subject_names)
+                    try:
+                        # Wait for this sheet's worker; re-raises any pipeline error here
+                        thresh_img, thresh_preview, original_preview, student_answers, subject_scores, total_score = future.result()
+
+                        with sheet_col1:
+                            st.image(original_preview, caption=f"Original Sheet {idx+1}", use_container_width=True)
+
+                        with sheet_col2:
+                            st.image(thresh_preview, caption="Processed Image", use_container_width=True)
+                        
+                        # Determine student name
+                        if student_name_input.strip():
+                            student_name = f"{student_name_input}_{idx+1}" if total_files > 1 else student_name_input
+                        else:
+                            student_name = f"Student_{idx+1}"
                     
-                    # Prepare result for display
-                    result_dict = {"Student": student_name}
-                    for i, subject in enumerate(st.session_state.subject_names):
-                        result_dict[subject] = subject_scores[i]
-                    result_dict["Total"] = total_score
-                    all_results.append(result_dict)
+                        # Queue for a single batched database write after the loop
+                        pending_rows.append((student_name, subject_scores, total_score))
                     
-                    # Show individual result with mini chart
-                    st.subheader(f"🎯 Results for {student_name}")
-                    result_df = pd.DataFrame([result_dict])
-                    st.dataframe(result_df, use_container_width=True)
+                        # Prepare result for display
+                        result_dict = {"Student": student_name}
+                        for i, subject in enumerate(subject_names):
+                            result_dict[subject] = subject_scores[i]
+                        result_dict["Total"] = total_score
+                        score_matrix[idx] = subject_scores
+                        totals[idx] = total_score
+                        student_names[idx] = student_name
+                        evaluated[idx] = True
                     
-                    # Individual student donut chart
-                    if show_charts:
-                        individual_scores = pd.Series(subject_scores, index=st.session_state.subject_names)
-                        individual_chart = create_donut_chart(
-                            individual_scores,
-                            f"📊 {student_name}'s Subject Scores"
+                        # Show individual result
+                        st.subheader(f"🎯 Results for {student_name}")
+                        # A one-row markdown table needs no DataFrame or Arrow serialization
+                        cells = [str(value).replace('|', '\\|') for value in result_dict.values()]
+                        headers = [str(key).replace('|', '\\|') for key in result_dict]
+                        st.markdown(
+                            "| " + " | ".join(headers) + " |\n"
+                            + "|" + "---|" * len(headers) + "\n"
+                            + "| " + " | ".join(cells) + " |"
                         )
-                        st.plotly_chart(individual_chart, use_container_width=True, key=f"individual_chart_{idx}_{student_name}")
                     
-                    if debug_mode:
-                        st.write("**🔍 Debug Info:**")
-                        st.write(f"Detected answers: {student_answers[:20]}...")
-                        st.write(f"Subject scores: {subject_scores}")
-                        st.write(f"Total score: {total_score}")
+                        if debug_mode:
+                            st.write("**🔍 Debug Info:**")
+                            st.write(f"Detected answers: {student_answers[:20]}...")
+                            st.write(f"Subject scores: {subject_scores}")
+                            st.write(f"Total score: {total_score}")
                     
-                except Exception as e:
-                    st.error(f"❌ Error processing sheet {idx+1}: {str(e)}")
-                    if debug_mode:
-                        st.exception(e)
+                    except Exception as e:
+                        st.error(f"❌ Error processing sheet {idx+1}: {str(e)}")
+                        if debug_mode:
+                            st.exception(e)
+        
+        # Save all evaluated sheets to database in one transaction
+        if pending_rows:
+            save_results_bulk(pending_rows, subject_names)
+            finalize_indexes()
         
         # Update progress
-        progress_bar.progress(1.0)
+        progress_bar.progress(100)
         status_text.text("✅ Evaluation completed!")
         
-        if all_results:
+        if evaluated.any():
             # Display summary results
             st.markdown('<div class="section-header">📊 Summary Results & Analytics</div>', unsafe_allow_html=True)
             
-            summary_df = pd.DataFrame(all_results)
+            # Column-oriented construction: each score column is a slice of the preallocated arrays
+            evaluated_scores = score_matrix[evaluated]
+            summary_df = pd.DataFrame({
+                'Student': [name for name, ok in zip(student_names, evaluated) if ok],
+                **{subject: evaluated_scores[:, i] for i, subject in enumerate(subject_names)},
+                'Total': totals[evaluated]
+            })
+            summary_df = downcast_scores(summary_df, subject_names + ['Total'])
             
             # Performance metrics cards
-            create_performance_metrics_cards(summary_df, st.session_state.subject_names)
+            create_performance_metrics_cards(summary_df, subject_names)
             
             # Main results table
             st.subheader("📋 Detailed Results Table")
             st.dataframe(summary_df, use_container_width=True)
             
             # Download button
-            csv_data = summary_df.to_csv(index=False)
+            csv_data = dataframe_to_csv_bytes(hash_dataframe(summary_df), summary_df)
             st.download_button(
                 label="📥 Download Results as CSV",
                 data=csv_data,
@@ -701,75 +965,91 @@ if st.button("🚀 Start Evaluation", type="primary", use_container_width=True):
                 
                 with chart_col1:
                     # Overall performance donut chart
-                    overall_chart = create_overall_performance_chart(summary_df, st.session_state.subject_names)
+                    overall_chart = create_overall_performance_chart(summary_df, subject_names)
                     if overall_chart:
                         st.plotly_chart(overall_chart, use_container_width=True, key="current_overall_chart")
                     
                     # Subject averages bar chart
-                    avg_chart = create_subject_averages_chart(summary_df, st.session_state.subject_names)
+                    avg_chart = create_subject_averages_chart(summary_df, subject_names)
                     if avg_chart:
                         st.plotly_chart(avg_chart, use_container_width=True, key="current_avg_chart")
                 
                 with chart_col2:
                     # Subject-wise distribution charts
-                    subject_charts = create_subject_wise_donut_charts(summary_df, st.session_state.subject_names)
+                    subject_charts = create_subject_wise_donut_charts(summary_df, subject_names)
                     if subject_charts:
                         st.plotly_chart(subject_charts, use_container_width=True, key="current_subject_charts")
+                
+                # Per-student scores in a single figure, one donut each
+                student_chart = create_student_donut_charts(summary_df, subject_names)
+                if student_chart:
+                    st.plotly_chart(student_chart, use_container_width=True, key="all_individuals")
 
 # Show all previous results with charts
 st.markdown('<div class="section-header">📋 Historical Results & Analytics</div>', unsafe_allow_html=True)
-try:
-    all_data, col_names = get_all_results()
-    if all_data and len(all_data) > 0:
-        df_all = pd.DataFrame(all_data, columns=col_names)
+# The history query and its charts only run once the user asks for them
+# (an expander would still execute its contents on every rerun)
+show_history = st.toggle("Load historical results & analytics", value=False)
+if show_history:
+    # Only pull the most recent rows so reruns stay fast as the history grows
+    history_limit = st.number_input("Rows to show (0 = all)", min_value=0, value=100, step=50)
+    try:
+        # Database reads are memoised in db_setup until the next write; the session fallback is never shared
+        df_all = get_results_dataframe(int(history_limit) or None)
+        if not df_all.empty:
+            df_all = downcast_scores(df_all, st.session_state.subject_names + ['Total'])
         
-        # Filter out non-subject columns
-        non_subject_cols = ['ID', 'Student', 'Total', 'Created_At']
-        subject_cols = [col for col in df_all.columns if col not in non_subject_cols and col in st.session_state.subject_names]
+            # Filter out non-subject columns
+            non_subject_cols = ['ID', 'Student', 'Total', 'Created_At']
+            subject_cols = [col for col in df_all.columns if col not in non_subject_cols and col in st.session_state.subject_names]
         
-        if subject_cols:
-            # Performance metrics for all historical data
-            st.subheader("📊 Historical Performance Metrics")
-            create_performance_metrics_cards(df_all, subject_cols)
+            if subject_cols:
+                # Project once to the columns the charts use, so each builder hashes and scans less
+                needed = ['Student'] + subject_cols + ['Total']
+                df_view = df_all[[col for col in needed if col in df_all.columns]]
+            
+                # Performance metrics for all historical data
+                st.subheader("📊 Historical Performance Metrics")
+                create_performance_metrics_cards(df_view, subject_cols)
             
-            # Charts for historical data
-            if show_charts and not df_all.empty:
-                hist_col1, hist_col2 = st.columns([1, 1])
+                # Charts for historical data
+                if show_charts and not df_view.empty:
+                    hist_col1, hist_col2 = st.columns([1, 1])
                 
-                with hist_col1:
-                    # Historical overall performance
-                    hist_overall = create_overall_performance_chart(df_all, subject_cols)
-                    if hist_overall:
-                        st.plotly_chart(hist_overall, use_container_width=True, key="historical_overall_chart")
+                    with hist_col1:
+                        # Historical overall performance
+                        hist_overall = create_overall_performance_chart(df_view, subject_cols)
+                        if hist_overall:
+                            st.plotly_chart(hist_overall, use_container_width=True, key="historical_overall_chart")
                 
-                with hist_col2:
-                    # Historical subject averages
-                    hist_avg = create_subject_averages_chart(df_all, subject_cols)
-                    if hist_avg:
-                        st.plotly_chart(hist_avg, use_container_width=True, key="historical_avg_chart")
+                    with hist_col2:
+                        # Historical subject averages
+                        hist_avg = create_subject_averages_chart(df_view, subject_cols)
+                        if hist_avg:
+                            st.plotly_chart(hist_avg, use_container_width=True, key="historical_avg_chart")
                 
-                # Historical subject-wise distribution
-                if len(subject_cols) > 0:
-                    hist_subjects = create_subject_wise_donut_charts(df_all, subject_cols)
-                    if hist_subjects:
-                        st.plotly_chart(hist_subjects, use_container_width=True, key="historical_subject_charts")
+                    # Historical subject-wise distribution
+                    if len(subject_cols) > 0:
+                        hist_subjects = create_subject_wise_donut_charts(df_view, subject_cols)
+                        if hist_subjects:
+                            st.plotly_chart(hist_subjects, use_container_width=True, key="historical_subject_charts")
         
-        st.subheader("📋 All Historical Data")
-        st.dataframe(df_all, use_container_width=True)
+            with st.expander("📋 Previous Results", expanded=False):
+                st.dataframe(df_all, use_container_width=True)
         
-        # Download all results
-        if not df_all.empty:
-            all_csv_data = df_all.to_csv(index=False)
-            st.download_button(
-                label="📥 Download All Historical Results",
-                data=all_csv_data,
-                file_name="all_omr_results.csv",
-                mime="text/csv"
-            )
-    else:
-        st.info("📊 No previous results found. Complete some evaluations to see analytics here!")
-except Exception as e:
-    st.error(f"Error loading previous results: {str(e)}")
+            # Download all results
+            if not df_all.empty:
+                all_csv_data = dataframe_to_csv_bytes(hash_dataframe(df_all), df_all)
+                st.download_button(
+                    label="📥 Download All Historical Results",
+                    data=all_csv_data,
+                    file_name="all_omr_results.csv",
+                    mime="text/csv"
+                )
+        else:
+            st.info("📊 No previous results found. Complete some evaluations to see analytics here!")
+    except Exception as e:
+        st.error(f"Error loading previous results: {str(e)}")
 
 # Add helpful information
 with st.expander("ℹ️ How to use this system & Chart Explanations"):
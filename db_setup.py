@@ -1,35 +1,121 @@
 # db_setup.py
 import sqlite3
+import atexit
+import functools
 import os
 import tempfile
+import threading
+
+import pandas as pd
+import streamlit as st
 
 
 # Use a temporary directory that's writable in deployed environments
 if "STREAMLIT_CLOUD" in os.environ or any(key in os.environ for key in ["DYNO", "RAILWAY_", "RENDER"]):
-    # Deployed environment - use temp directory
+    # Deployed environment - the temp directory can be evicted, so the database lives in memory
+    # and is snapshotted to the temp directory after every saved batch and on shutdown
     DB_DIR = tempfile.gettempdir()
-    DB_FILE = os.path.join(DB_DIR, "omr_results.db")
+    DB_FILE = ":memory:"
+    BACKUP_FILE = os.path.join(DB_DIR, "omr_results.db")
 else:
     # Local environment
     DB_FILE = "omr_results.db"
+    BACKUP_FILE = None
+
+
+# Applied once when the connection opens:
+# WAL lets readers run alongside the writer, NORMAL only fsyncs at checkpoints,
+# temp tables/sorts stay in memory, a 64 MB page cache, and waits on a locked file instead of failing
+# (an in-memory database ignores the journal and sync settings)
+CONNECTION_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA busy_timeout=5000;
+"""
+
+# Index-ordered scan for the newest-first listing, and direct lookups by student
+RESULT_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_results_created ON results(Created_At DESC, ID DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_results_student ON results(Student)",
+)
+
+# Serializes writes on the shared connection (Streamlit sessions run in separate threads)
+_write_lock = threading.Lock()
+
+# Bumped on every write; part of the read_results cache key
+_write_version = 0
+
+# Set by every write and cleared by a snapshot to BACKUP_FILE; shutdown only snapshots when it's set
+_unsaved_writes = False
+
+# The connection get_connection has open, if any (None until first use and after a reset)
+_connection = None
 
 
-def init_db(subjects=None):
+def bump_write_version():
+    """
+    Invalidate cached reads after a write
+    """
+    global _write_version, _unsaved_writes
+    _write_version += 1
+    _unsaved_writes = True
+
+
+@st.cache_resource
+def get_connection():
+    """
+    Shared SQLite connection, opened once per process instead of on every call
+    Autocommit mode; batched writes open their own transaction
+    """
+    global _connection
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+    conn.executescript(CONNECTION_PRAGMAS)
+    
+    # An in-memory database starts from the last snapshot, if there is one
+    if DB_FILE == ":memory:" and BACKUP_FILE and os.path.exists(BACKUP_FILE):
+        snapshot = sqlite3.connect(BACKUP_FILE)
+        try:
+            snapshot.backup(conn)
+        finally:
+            snapshot.close()
+    
+    atexit.register(close_connection, conn)
+    _connection = conn
+    return conn
+
+
+def close_connection(conn):
+    """
+    Close the shared connection on shutdown
+    A file database checkpoints its WAL into the main file; an in-memory one is snapshotted first
+    if anything was written since the last snapshot
+    """
+    if BACKUP_FILE and _unsaved_writes:
+        backup(conn=conn)
+    conn.close()
+
+
+def init_db(subjects=None, defer_indexes=False):
     """
     Initialize the database with dynamic columns based on subjects
+    defer_indexes: skip index creation; call finalize_indexes() once the bulk load is done
     """
     if subjects is None:
         subjects = []
     
     try:
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+        # Ensure directory exists (a bare file name or an in-memory database has none)
+        if os.path.dirname(DB_FILE):
+            os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
         
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_connection()
         c = conn.cursor()
-        
+
         # Drop existing table to recreate with new structure
-        c.execute("DROP TABLE IF EXISTS results")
+        with _write_lock:
+            c.execute("DROP TABLE IF EXISTS results")
         
         # Create columns string for subjects
         if subjects:
@@ -59,9 +145,12 @@ def init_db(subjects=None):
                 )
             """
         
-        c.execute(sql)
-        conn.commit()
-        conn.close()
+        with _write_lock:
+            c.execute(sql)
+            if not defer_indexes:
+                for index_sql in RESULT_INDEXES:
+                    c.execute(index_sql)
+            bump_write_version()
         print(f"Database initialized successfully at: {DB_FILE}")
         return True
         
@@ -70,6 +159,23 @@ def init_db(subjects=None):
         return False
 
 
+def finalize_indexes():
+    """
+    Create the results indexes after a bulk load (no-op if they already exist)
+    Building them once over the loaded rows is cheaper than updating them on every insert
+    """
+    try:
+        conn = get_connection()
+        c = conn.cursor()
+        with _write_lock:
+            for index_sql in RESULT_INDEXES:
+                c.execute(index_sql)
+        return True
+    except Exception as e:
+        print(f"Error creating indexes: {str(e)}")
+        return False
+
+
 def save_results(student_name, subject_scores, total_score, subjects):
     """
     Save evaluation results to database
@@ -78,36 +184,20 @@ def save_results(student_name, subject_scores, total_score, subjects):
         print("Invalid data provided to save_results")
         return False
     
+    # Single-row case of the batched insert, so both paths share the same code
+    return save_results_bulk([(student_name, subject_scores, total_score)], subjects)
+
+
+def save_results_to_cache(rows, subjects):
+    """
+    Keep results in the session state cache when the database is unavailable
+    rows: list of (student_name, subject_scores, total_score) tuples
+    """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
+        if 'results_cache' not in st.session_state:
+            st.session_state.results_cache = []
         
-        # Prepare column names and values
-        subject_cols = ", ".join([f'"{subject}"' for subject in subjects])
-        placeholders = ", ".join(["?"] * (len(subjects) + 2))  # +2 for Student and Total
-        
-        sql = f"""
-            INSERT INTO results (Student, {subject_cols}, Total)
-            VALUES ({placeholders})
-        """
-        
-        # Prepare values tuple
-        values = [student_name] + list(subject_scores) + [total_score]
-        
-        c.execute(sql, values)
-        conn.commit()
-        conn.close()
-        
-        print(f"Successfully saved results for {student_name}")
-        return True
-        
-    except Exception as e:
-        print(f"Error saving results: {str(e)}")
-        # Try alternative approach - create in-memory storage
-        try:
-            if 'results_cache' not in st.session_state:
-                st.session_state.results_cache = []
-            
+        for student_name, subject_scores, total_score in rows:
             result = {
                 'Student': student_name,
                 'Total': total_score,
@@ -118,51 +208,129 @@ def save_results(student_name, subject_scores, total_score, subjects):
             
             st.session_state.results_cache.append(result)
             print(f"Saved to session cache for {student_name}")
-            return True
-        except:
-            return False
+        return True
+    except:
+        return False
 
 
-def get_all_results():
+def save_results_bulk(rows, subjects):
     """
-    Retrieve all results from database or session cache
+    Save many evaluation results to database in a single transaction
+    rows: list of (student_name, subject_scores, total_score) tuples
     """
+    if not rows or not subjects:
+        print("Invalid data provided to save_results_bulk")
+        return False
+
     try:
-        # Try database first
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_connection()
         c = conn.cursor()
+
+        # Prepare column names and values
+        subject_cols = ", ".join([f'"{subject}"' for subject in subjects])
+        placeholders = ", ".join(["?"] * (len(subjects) + 2))  # +2 for Student and Total
+
+        sql = f"""
+            INSERT INTO results (Student, {subject_cols}, Total)
+            VALUES ({placeholders})
+        """
+
+        values = [
+            (student_name, *subject_scores, total_score)
+            for student_name, subject_scores, total_score in rows
+        ]
+
+        # One transaction (and one commit) for the whole batch
+        with _write_lock:
+            c.execute("BEGIN")
+            try:
+                c.executemany(sql, values)
+                conn.commit()
+                bump_write_version()
+            except Exception:
+                # Leave the shared connection usable for later calls, and drop any read of the rolled-back rows
+                conn.rollback()
+                bump_write_version()
+                raise
+
+        print(f"Successfully saved results for {len(values)} students")
         
-        # Check if table exists
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='results';")
-        if not c.fetchone():
-            conn.close()
+        # Snapshot an in-memory database after every batch, so a restart loses nothing saved
+        if BACKUP_FILE:
+            backup()
+        return True
+
+    except Exception as e:
+        print(f"Error saving results: {str(e)}")
+        # Try alternative approach - create in-memory storage
+        return save_results_to_cache(rows, subjects)
+
+
+def get_all_results(limit=None):
+    """
+    Retrieve results from database or session cache, newest first, as (rows, column names)
+    limit: maximum number of rows to return (None returns everything)
+    """
+    df = get_results_dataframe(limit)
+    return list(df.itertuples(index=False, name=None)), df.columns.tolist()
+
+
+def get_results_dataframe(limit=None):
+    """
+    Retrieve results from database or session cache, newest first, as a DataFrame
+    limit: maximum number of rows to return (None returns everything)
+    """
+    try:
+        # Try database first (served from memory when nothing was written since the last read)
+        df = read_results(_write_version, int(limit) if limit else None)
+        if df is None:
             # Fallback to session cache
-            return get_results_from_cache()
+            data, col_names = get_results_from_cache(limit)
+            return pd.DataFrame(data, columns=col_names)
         
-        # Get all data
-        c.execute("SELECT * FROM results ORDER BY Created_At DESC")
-        data = c.fetchall()
-        
-        # Get column names
-        col_names = [description[0] for description in c.description]
-        
-        conn.close()
-        return data, col_names
+        # Callers get their own copy of the cached frame
+        return df.copy()
         
     except Exception as e:
         print(f"Error retrieving results from database: {str(e)}")
         # Fallback to session cache
-        return get_results_from_cache()
+        data, col_names = get_results_from_cache(limit)
+        return pd.DataFrame(data, columns=col_names)
+
+
+@functools.lru_cache(maxsize=4)
+def read_results(write_version, limit=None):
+    """
+    Query the results table straight into a DataFrame, newest first; None if the table doesn't exist
+    write_version only keys the cache: every write bumps it, so stale entries are never hit
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    
+    # The connection is shared, so reading mid-transaction would see another session's uncommitted rows
+    with _write_lock:
+        # Check if table exists
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='results';")
+        if not c.fetchone():
+            return None
+        
+        # Get the most recent rows (all of them when no limit is given)
+        if limit:
+            return pd.read_sql_query("SELECT * FROM results ORDER BY Created_At DESC, ID DESC LIMIT ?", conn, params=(limit,))
+        return pd.read_sql_query("SELECT * FROM results ORDER BY Created_At DESC, ID DESC", conn)
 
 
-def get_results_from_cache():
+def get_results_from_cache(limit=None):
     """
     Get results from session state cache as fallback
     """
     try:
         import streamlit as st
         if 'results_cache' in st.session_state and st.session_state.results_cache:
-            cache_data = st.session_state.results_cache
+            # Newest first, like the database query
+            cache_data = st.session_state.results_cache[::-1]
+            if limit:
+                cache_data = cache_data[:int(limit)]
             if cache_data:
                 # Convert to format expected by calling code
                 df = pd.DataFrame(cache_data)
@@ -180,11 +348,11 @@ def delete_all_results():
     Delete all results from database (for testing purposes)
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_connection()
         c = conn.cursor()
-        c.execute("DELETE FROM results")
-        conn.commit()
-        conn.close()
+        with _write_lock:
+            c.execute("DELETE FROM results")
+            bump_write_version()
         print("All results deleted successfully")
         return True
     except Exception as e:
@@ -197,13 +365,12 @@ def get_database_info():
     Get information about the database structure
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_connection()
         c = conn.cursor()
         
         # Check if table exists
         c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='results';")
         if not c.fetchone():
-            conn.close()
             return {"exists": False}
         
         # Get table info
@@ -214,8 +381,6 @@ def get_database_info():
         c.execute("SELECT COUNT(*) FROM results")
         row_count = c.fetchone()[0]
         
-        conn.close()
-        
         return {
             "exists": True,
             "columns": table_info,
@@ -227,17 +392,58 @@ def get_database_info():
         return {"exists": False, "error": str(e)}
 
 
+def backup(path=None, conn=None):
+    """
+    Copy the whole database to a file on disk (defaults to BACKUP_FILE)
+    conn: connection to copy (defaults to the shared connection)
+    """
+    global _unsaved_writes
+    path = path or BACKUP_FILE
+    if not path:
+        print("No backup file configured")
+        return False
+    
+    try:
+        target = sqlite3.connect(path)
+        try:
+            with _write_lock:
+                (conn or get_connection()).backup(target)
+                if path == BACKUP_FILE:
+                    _unsaved_writes = False
+        finally:
+            target.close()
+        print(f"Database backed up to: {path}")
+        return True
+    except Exception as e:
+        print(f"Error backing up database: {str(e)}")
+        return False
+
+
 def reset_database():
     """
     Reset the database by deleting the file
     """
+    global _connection, _unsaved_writes
     try:
-        if os.path.exists(DB_FILE):
-            os.remove(DB_FILE)
-            print(f"Database file {DB_FILE} deleted successfully")
+        # Drop the shared connection (if one is open) so it doesn't keep the deleted file open
+        # and shutdown doesn't snapshot it again
+        if _connection is not None:
+            atexit.unregister(close_connection)
+            _connection.close()
+            get_connection.clear()
+            _connection = None
+        bump_write_version()
+        # Nothing is left to snapshot until the next write
+        _unsaved_writes = False
+        
+        # An in-memory database is gone with its connection; remove its snapshot instead
+        db_path = BACKUP_FILE if DB_FILE == ":memory:" else DB_FILE
+        if os.path.exists(db_path):
+            os.remove(db_path)
+            print(f"Database file {db_path} deleted successfully")
             return True
         else:
-            print(f"Database file {DB_FILE} does not exist")
+            print(f"Database file {db_path} does not exist")
             return True
     except Exception as e:
         print(f"Error resetting database: {str(e)}")
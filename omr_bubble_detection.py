@@ -1,16 +1,29 @@
 # omr_bubble_detection.py
+import functools
+
 import cv2
 import numpy as np
 
+from omr_preprocessing import TARGET_HEIGHT
+
+
+# One record per detected bubble: bounding box, centre and contour area
+BUBBLE_DTYPE = np.dtype([
+    ('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+    ('center_x', np.int32), ('center_y', np.int32), ('area', np.float64),
+])
+
 
 def find_bubble_grid(thresh_img, debug=False):
     """
     Find and sort bubble contours in a grid pattern
+    Returns (contours, bubbles): the bubble contours and a matching BUBBLE_DTYPE array
     """
     # Find all contours
     contours, _ = cv2.findContours(thresh_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     bubble_contours = []
+    bubble_records = []
     
     # Filter contours that look like bubbles
     img_area = thresh_img.shape[0] * thresh_img.shape[1]
@@ -38,58 +51,86 @@ def find_bubble_grid(thresh_img, debug=False):
             0.6 <= aspect_ratio <= 1.4 and  # Roughly square
             w > 10 and h > 10):  # Minimum size
             
-            bubble_contours.append({
-                'contour': contour,
-                'x': x, 'y': y, 'w': w, 'h': h,
-                'center_x': x + w//2,
-                'center_y': y + h//2,
-                'area': area
-            })
+            bubble_contours.append(contour)
+            bubble_records.append((x, y, w, h, x + w//2, y + h//2, area))
+    
+    bubbles = np.array(bubble_records, dtype=BUBBLE_DTYPE)
     
     if debug:
-        print(f"Found {len(bubble_contours)} potential bubbles")
+        print(f"Found {len(bubbles)} potential bubbles")
     
     # Sort bubbles: first by row (y-coordinate), then by column (x-coordinate)
-    bubble_contours.sort(key=lambda b: (b['center_y'], b['center_x']))
+    order = np.lexsort((bubbles['center_x'], bubbles['center_y']))
+    bubbles = bubbles[order]
+    bubble_contours = [bubble_contours[i] for i in order]
     
-    return bubble_contours
+    return bubble_contours, bubbles
 
 
-def group_bubbles_into_questions(bubble_contours, choices_per_question=5):
+def group_bubbles_into_questions(bubbles, choices_per_question=5):
     """
     Group bubbles into questions based on their positions
+    bubbles: BUBBLE_DTYPE array sorted by row, as returned by find_bubble_grid
     """
-    if not bubble_contours:
+    if len(bubbles) == 0:
         return []
     
     questions = []
-    current_row_y = bubble_contours[0]['center_y']
-    current_question = []
+    center_y = bubbles['center_y']
     row_threshold = 30  # Pixels tolerance for same row
     
-    for bubble in bubble_contours:
-        # If bubble is in roughly the same row
-        if abs(bubble['center_y'] - current_row_y) <= row_threshold:
-            current_question.append(bubble)
-        else:
-            # New row - save current question if it has the right number of choices
-            if len(current_question) == choices_per_question:
-                # Sort by x-coordinate within the question
-                current_question.sort(key=lambda b: b['center_x'])
-                questions.append(current_question)
-            
-            # Start new question
-            current_question = [bubble]
-            current_row_y = bubble['center_y']
-    
-    # Don't forget the last question
-    if len(current_question) == choices_per_question:
-        current_question.sort(key=lambda b: b['center_x'])
-        questions.append(current_question)
+    row_start = 0
+    while row_start < len(bubbles):
+        # A row is every bubble within the tolerance of the row's first bubble
+        row_end = np.searchsorted(center_y, center_y[row_start] + row_threshold, side='right')
+        
+        # Save the row as a question if it has the right number of choices
+        if row_end - row_start == choices_per_question:
+            # Sort by x-coordinate within the question
+            row = bubbles[row_start:row_end]
+            questions.append(row[np.argsort(row['center_x'], kind='stable')])
+        
+        row_start = row_end
     
     return questions
 
 
+@functools.lru_cache(maxsize=8)
+def innomatics_row_regions(height):
+    """
+    Row region (start, end) of every question on an Innomatics sheet of the given height
+    Returns (question_nums, row_start, row_end), each shaped (5 subjects, 20 questions)
+    """
+    questions_per_subject = 20
+    rows_per_section = height // 25  # Approximate rows per question group
+    
+    # Question numbers per subject: PYTHON 1-20, DATA ANALYSIS 21-40, MySQL 41-60, POWER BI 61-80, Adv STATS 81-100
+    question_nums = np.arange(1, 5 * questions_per_subject + 1).reshape(5, questions_per_subject)
+    
+    # Row position for each question, using uniform distribution as fallback:
+    # questions 1-20 sit in four groups of five, one group per quarter of the sheet;
+    # any other question number has no row (-1) and reads the strip at the top of the sheet
+    question_row_y = np.full(question_nums.shape, -1)
+    for group in range(4):
+        in_group = (question_nums > 5 * group) & (question_nums <= 5 * (group + 1))
+        question_row_y[in_group] = (question_nums[in_group] - 5 * group - 1) * rows_per_section + group * height // 4
+    
+    # Row region for each question, clamped the same way slicing would
+    row_start = np.minimum(np.maximum(0, question_row_y - rows_per_section // 2), height)
+    row_end = np.minimum(height, question_row_y + rows_per_section // 2)
+    row_end = np.clip(np.where(row_end < 0, row_end + height, row_end), row_start, height)
+    
+    # Shared between calls, so keep them read-only
+    for arr in (question_nums, row_start, row_end):
+        arr.flags.writeable = False
+    
+    return question_nums, row_start, row_end
+
+
+# Preprocessed sheets are all TARGET_HEIGHT tall, so their layout is computed once at import
+innomatics_row_regions(TARGET_HEIGHT)
+
+
 def extract_bubbles_for_innomatics_sheet(thresh_img, debug=False):
     """
     Specialized extraction for Innomatics OMR sheet format
@@ -105,107 +146,56 @@ def extract_bubbles_for_innomatics_sheet(thresh_img, debug=False):
     questions_per_subject = 20
     choices_per_question = 4  # A, B, C, D
     
-    student_answers = []
-    
     # Approximate column boundaries (adjust based on actual sheet dimensions)
     col_width = width // 5
+    bubble_width = col_width // 4
     
-    for subject_idx in range(5):  # 5 subjects
-        subject_answers = []
-        
-        # Define column boundaries
+    # Row region of every question (precomputed for the standard sheet height)
+    question_nums, row_start, row_end = innomatics_row_regions(height)
+    
+    # Filled pixels per row in each choice column (A, B, C, D), summed over just the rows a subject reads;
+    # every question's count is then the difference of two running totals
+    filled_pixels = np.zeros(question_nums.shape + (choices_per_question,), dtype=np.int64)
+    for subject_idx in range(5):
+        top, bottom = row_start[subject_idx].min(), row_end[subject_idx].max()
         col_start = subject_idx * col_width
-        col_end = (subject_idx + 1) * col_width
+        subject_block = thresh_img[top:bottom, col_start:col_start + choices_per_question * bubble_width]
+        row_counts = (subject_block != 0).reshape(bottom - top, choices_per_question, bubble_width).sum(axis=-1)
         
-        # Extract the column for this subject
-        subject_column = thresh_img[:, col_start:col_end]
-        
-        # Process questions in this subject (1-20)
-        for q in range(questions_per_subject):
-            # Calculate approximate row position for this question
-            # Questions are numbered 1-20, but arranged in different patterns per subject
-            
-            if subject_idx == 0:  # PYTHON: 1-20 in order
-                question_num = q + 1
-            elif subject_idx == 1:  # DATA ANALYSIS: 21-40
-                question_num = q + 21
-            elif subject_idx == 2:  # MySQL: 41-60  
-                question_num = q + 41
-            elif subject_idx == 3:  # POWER BI: 61-80
-                question_num = q + 61
-            else:  # Adv STATS: 81-100
-                question_num = q + 81
-            
-            # Find the actual row for this question number in the image
-            row_found = False
-            question_row_y = -1
-            
-            # Look for question number pattern in the image
-            # For now, use uniform distribution as fallback
-            rows_per_section = height // 25  # Approximate rows per question group
-            
-            if question_num <= 5:
-                question_row_y = (question_num - 1) * rows_per_section
-            elif question_num <= 10:
-                question_row_y = (question_num - 6) * rows_per_section + height // 4
-            elif question_num <= 15:
-                question_row_y = (question_num - 11) * rows_per_section + height // 2
-            elif question_num <= 20:
-                question_row_y = (question_num - 16) * rows_per_section + 3 * height // 4
-            
-            # Extract the row region for this question
-            row_start = max(0, question_row_y - rows_per_section // 2)
-            row_end = min(height, question_row_y + rows_per_section // 2)
-            
-            question_row = subject_column[row_start:row_end, :]
-            
-            # Find bubbles in this row (A, B, C, D)
-            bubble_ratios = []
-            bubble_width = question_row.shape[1] // 4
-            
-            for choice in range(4):  # A, B, C, D
-                choice_start = choice * bubble_width
-                choice_end = (choice + 1) * bubble_width
-                
-                bubble_region = question_row[:, choice_start:choice_end]
-                
-                if bubble_region.size == 0:
-                    bubble_ratios.append(0)
-                    continue
-                
-                # Calculate filled ratio
-                total_pixels = bubble_region.shape[0] * bubble_region.shape[1]
-                filled_pixels = np.count_nonzero(bubble_region)
-                filled_ratio = filled_pixels / total_pixels if total_pixels > 0 else 0
-                
-                bubble_ratios.append(filled_ratio)
-            
-            # Select the choice with highest fill ratio
-            if bubble_ratios and max(bubble_ratios) > 0.05:  # At least 5% filled
-                selected_choice = np.argmax(bubble_ratios) + 1  # Convert to 1-based (A=1, B=2, C=3, D=4)
-            else:
-                selected_choice = 1  # Default to A if nothing clear
-            
-            subject_answers.append(selected_choice)
-            
-            if debug and subject_idx == 0 and q < 5:
-                print(f"Subject {subject_idx+1}, Q{question_num}: ratios={[f'{r:.3f}' for r in bubble_ratios]}, selected={selected_choice}")
-        
-        student_answers.extend(subject_answers)
+        running_total = np.zeros((bottom - top + 1, choices_per_question), dtype=np.int64)
+        np.cumsum(row_counts, axis=0, out=running_total[1:])
+        filled_pixels[subject_idx] = running_total[row_end[subject_idx] - top] - running_total[row_start[subject_idx] - top]
+    
+    # Calculate filled ratios (empty regions count as 0)
+    total_pixels = ((row_end - row_start) * bubble_width)[:, :, None]
+    bubble_ratios = np.divide(filled_pixels, total_pixels, out=np.zeros(filled_pixels.shape), where=total_pixels > 0)
+    
+    # Select the choice with highest fill ratio, defaulting to A if nothing is at least 5% filled
+    selected_choice = np.where(bubble_ratios.max(axis=-1) > 0.05, bubble_ratios.argmax(axis=-1) + 1, 1)
+    student_answers = selected_choice.ravel().tolist()
     
     if debug:
+        for q in range(5):
+            print(f"Subject 1, Q{question_nums[0, q]}: ratios={[f'{r:.3f}' for r in bubble_ratios[0, q]]}, selected={selected_choice[0, q]}")
         print(f"Total extracted answers: {len(student_answers)}")
         print(f"First 20 answers: {student_answers[:20]}")
     
     return student_answers
 
 
+# Specialized extractors by sheet layout: (num_subjects, questions_per_subject, choices_per_question)
+SHEET_EXTRACTORS = {
+    (5, 20, 4): extract_bubbles_for_innomatics_sheet,
+}
+
+
 def extract_bubbles(thresh_img, num_subjects=5, questions_per_subject=20, choices_per_question=4, debug=False):
     """
     Main bubble extraction function - routes to specialized version for Innomatics sheets
     """
-    if num_subjects == 5 and questions_per_subject == 20 and choices_per_question == 4:
-        return extract_bubbles_for_innomatics_sheet(thresh_img, debug)
+    extractor = SHEET_EXTRACTORS.get((num_subjects, questions_per_subject, choices_per_question))
+    if extractor is not None:
+        return extractor(thresh_img, debug)
     
     # Fallback to original method for other formats
     return extract_bubbles_generic(thresh_img, num_subjects, questions_per_subject, choices_per_question, debug)
@@ -218,32 +208,32 @@ def extract_bubbles_generic(thresh_img, num_subjects=5, questions_per_subject=20
     total_expected_questions = num_subjects * questions_per_subject
     
     # Find all bubble contours
-    bubble_contours = find_bubble_grid(thresh_img, debug)
+    _, bubbles = find_bubble_grid(thresh_img, debug)
     
-    if len(bubble_contours) == 0:
+    if len(bubbles) == 0:
         if debug:
             print("No bubbles detected!")
         return [1] * total_expected_questions  # Default answers
     
     # Group bubbles into questions
-    questions = group_bubbles_into_questions(bubble_contours, choices_per_question)
+    questions = group_bubbles_into_questions(bubbles, choices_per_question)
     
     if debug:
         print(f"Grouped into {len(questions)} questions")
         print(f"Expected {total_expected_questions} questions")
     
-    student_answers = []
+    # One slot per expected question, defaulting to option A; missing questions keep the default
+    # and questions beyond the expected count are not scored
+    student_answers = np.ones(total_expected_questions, dtype=np.int8)
     
-    for question_idx, question_bubbles in enumerate(questions):
+    for question_idx, question_bubbles in enumerate(questions[:total_expected_questions]):
         if len(question_bubbles) != choices_per_question:
             # Skip malformed questions
-            student_answers.append(1)  # Default to option A
             continue
         
         # Calculate filled ratio for each choice
         choice_ratios = []
-        for bubble in question_bubbles:
-            x, y, w, h = bubble['x'], bubble['y'], bubble['w'], bubble['h']
+        for x, y, w, h in question_bubbles[['x', 'y', 'w', 'h']].tolist():
             
             # Extract bubble region with some padding
             padding = 2
@@ -260,13 +250,12 @@ def extract_bubbles_generic(thresh_img, num_subjects=5, questions_per_subject=20
             
             # Calculate how much of the bubble is filled
             total_pixels = bubble_roi.shape[0] * bubble_roi.shape[1]
-            filled_pixels = np.count_nonzero(bubble_roi)
+            filled_pixels = cv2.countNonZero(bubble_roi)
             filled_ratio = filled_pixels / total_pixels if total_pixels > 0 else 0
             
             choice_ratios.append(filled_ratio)
         
         if not choice_ratios:
-            student_answers.append(1)
             continue
         
         # Find the choice with maximum fill ratio
@@ -279,17 +268,12 @@ def extract_bubbles_generic(thresh_img, num_subjects=5, questions_per_subject=20
         else:
             selected_answer = 1  # Default if nothing is clearly marked
         
-        student_answers.append(selected_answer)
+        student_answers[question_idx] = selected_answer
         
         if debug and question_idx < 5:  # Debug first 5 questions
             print(f"Question {question_idx + 1}: Ratios {[f'{r:.3f}' for r in choice_ratios]}, Selected: {selected_answer}")
     
-    # Pad or truncate to expected number of questions
-    while len(student_answers) < total_expected_questions:
-        student_answers.append(1)  # Default answers for missing questions
-    
-    if len(student_answers) > total_expected_questions:
-        student_answers = student_answers[:total_expected_questions]
+    student_answers = student_answers.tolist()
     
     if debug:
         print(f"Final answers: {student_answers[:10]}...")  # Show first 10
@@ -1,36 +1,93 @@
 # omr_preprocessing.py
+import threading
+
 import cv2
 import numpy as np
 
 
-def preprocess_omr(file):
+# Height every sheet is resized to before thresholding
+TARGET_HEIGHT = 1200
+
+# The morphology kernel is read-only, so one instance is shared by every call
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2, 2))
+
+# CLAHE objects keep internal buffers, so each worker thread gets its own
+_thread_local = threading.local()
+
+
+def get_clahe():
     """
-    Input: uploaded OMR image file (from Streamlit)
-    Output: thresholded, perspective-corrected image
+    CLAHE instance for the current thread, created on first use
     """
-    # Read image
-    file_bytes = np.frombuffer(file.read(), np.uint8)
-    img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    clahe = getattr(_thread_local, 'clahe', None)
+    if clahe is None:
+        clahe = _thread_local.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    return clahe
+
+
+def decode_image(file, grayscale=False):
+    """
+    Decode an uploaded OMR image file (from Streamlit) or its raw bytes into a BGR array
+    grayscale: decode straight to a single-channel array instead
+    """
+    # Raw bytes are decoded directly, no second read of the upload
+    data = file if isinstance(file, (bytes, bytearray, memoryview)) else file.read()
+    file_bytes = np.frombuffer(data, np.uint8)
+    img = cv2.imdecode(file_bytes, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
     
     if img is None:
         raise ValueError("Could not decode image")
     
+    return img
+
+
+def resize_for_display(img, max_dim=800):
+    """
+    Downscale an image so its longest side is at most max_dim pixels
+    Only used for previews; the pipeline keeps working on the full-resolution image
+    """
+    scale = max_dim / max(img.shape[:2])
+    if scale >= 1:
+        return img
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def encode_preview(img, max_dim=800):
+    """
+    Downscaled JPEG bytes of an image, small enough to send to the browser
+    """
+    ok, buf = cv2.imencode('.jpg', resize_for_display(img, max_dim))
+    if not ok:
+        raise ValueError("Could not encode preview image")
+    return buf.tobytes()
+
+
+def preprocess_omr(file):
+    """
+    Input: uploaded OMR image file (from Streamlit), its raw bytes, or an already decoded image array (BGR or grayscale)
+    Output: thresholded, perspective-corrected image
+    """
+    # Read image (an array that was decoded by the caller is used as is);
+    # only the grayscale image is needed, so files are decoded to a single channel
+    img = file if isinstance(file, np.ndarray) else decode_image(file, grayscale=True)
+    
     # Store original for debugging
     original_height, original_width = img.shape[:2]
     
     # Resize maintaining aspect ratio but ensuring minimum size
-    target_height = 1200
+    target_height = TARGET_HEIGHT
     aspect_ratio = original_width / original_height
     target_width = int(target_height * aspect_ratio)
     
-    img = cv2.resize(img, (target_width, target_height))
+    # Area averaging when shrinking large photos, bilinear when enlarging
+    interpolation = cv2.INTER_AREA if original_height > target_height else cv2.INTER_LINEAR
+    img = cv2.resize(img, (target_width, target_height), interpolation=interpolation)
     
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Convert to grayscale (already single-channel when decoded here)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
     
     # Apply CLAHE for better contrast
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    gray = clahe.apply(gray)
+    gray = get_clahe().apply(gray)
     
     # Gaussian blur to reduce noise
     blur = cv2.GaussianBlur(gray, (3, 3), 0)
@@ -39,7 +96,6 @@ def preprocess_omr(file):
     _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     
     # Morphological operations to clean up
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2, 2))
-    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, MORPH_KERNEL)
     
     return thresh  # Return only the processed image
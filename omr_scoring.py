@@ -1,4 +1,40 @@
 # omr_scoring.py
+import functools
+
+import numpy as np
+
+
+# Plain letter and digit answers, the usual content of an Excel answer key
+LETTER_MAP = {
+    "a": 1, "b": 2, "c": 3, "d": 4,
+    "A": 1, "B": 2, "C": 3, "D": 4,
+    "1": 1, "2": 2, "3": 3, "4": 4,
+}
+
+
+def convert_answer(ans):
+    """
+    Convert one answer (letter, number string or number) to 1-4, defaulting to 1
+    """
+    if isinstance(ans, str):
+        ans_clean = ans.strip().lower()
+        if ans_clean in LETTER_MAP:
+            return LETTER_MAP[ans_clean]
+        # Try to convert to int if it's a number string
+        try:
+            ans_int = int(ans_clean)
+            if 1 <= ans_int <= 4:
+                return ans_int
+            return 1  # Default to 1 if out of range
+        except (ValueError, TypeError):
+            return 1  # Default to 1 if can't convert
+    elif isinstance(ans, (int, float)):
+        # Ensure it's in valid range
+        ans_int = int(ans)
+        if 1 <= ans_int <= 4:
+            return ans_int
+        return 1  # Default
+    return 1  # Default for any other type
 
 
 def convert_answer_key_letters(answer_key):
@@ -6,94 +42,153 @@ def convert_answer_key_letters(answer_key):
     Convert letter answers (a, b, c, d) to numbers (1, 2, 3, 4)
     Handle both strings and numbers
     """
-    letter_map = {"a": 1, "b": 2, "c": 3, "d": 4, "A": 1, "B": 2, "C": 3, "D": 4}
-    converted = []
-    
-    for ans in answer_key:
-        if isinstance(ans, str):
-            ans_clean = ans.strip().lower()
-            if ans_clean in letter_map:
-                converted.append(letter_map[ans_clean])
-            else:
-                # Try to convert to int if it's a number string
-                try:
-                    ans_int = int(ans_clean)
-                    if 1 <= ans_int <= 4:
-                        converted.append(ans_int)
-                    else:
-                        converted.append(1)  # Default to 1 if out of range
-                except (ValueError, TypeError):
-                    converted.append(1)  # Default to 1 if can't convert
-        elif isinstance(ans, (int, float)):
-            # Ensure it's in valid range
-            ans_int = int(ans)
-            if 1 <= ans_int <= 4:
-                converted.append(ans_int)
-            else:
-                converted.append(1)  # Default
-        else:
-            converted.append(1)  # Default for any other type
+    if not isinstance(answer_key, (list, tuple)):
+        answer_key = list(answer_key)
     
-    return converted
+    # Keys are almost always all letters or all numbers, so the first entry picks the fast path;
+    # entries that don't fit it still go through the full conversion
+    if answer_key and type(answer_key[0]) is int:
+        return [
+            ans if type(ans) is int and 1 <= ans <= 4 else convert_answer(ans)
+            for ans in answer_key
+        ]
+    
+    # Plain letters/digits are a single dict lookup
+    return [
+        LETTER_MAP[ans] if type(ans) is str and ans in LETTER_MAP else convert_answer(ans)
+        for ans in answer_key
+    ]
 
 
-def calculate_score(student_answers, answer_key, num_subjects=5, questions_per_subject=20, debug=False):
+def fit_answers(answers, length):
+    """
+    Pad the last axis with 1s (option A) or truncate it to the given length
+    Used for answer lists that don't match the expected number of questions
+    """
+    missing = length - answers.shape[-1]
+    if missing <= 0:
+        return answers[..., :length]
+    fitted = np.ones(answers.shape[:-1] + (length,), dtype=answers.dtype)
+    fitted[..., :answers.shape[-1]] = answers
+    return fitted
+
+
+@functools.lru_cache(maxsize=8)
+def convert_answer_key_cached(key_tuple, key_types):
+    """
+    convert_answer_key_letters memoized on the key, so repeated scoring converts each distinct key once
+    key_types keeps equal values of different types (1 vs np.int64(1)) from sharing an entry
+    """
+    return tuple(convert_answer_key_letters(key_tuple))
+
+
+def answer_key_array(answer_key):
+    """
+    Answer key as an int8 array of numbers (a numeric ndarray key is used as is)
+    """
+    if isinstance(answer_key, np.ndarray):
+        if answer_key.dtype.kind in 'iub':
+            return answer_key.astype(np.int8, copy=False)
+        # Letter (or mixed object) arrays still need converting
+        answer_key = answer_key.tolist()
+    try:
+        key_tuple = tuple(answer_key)
+        answer_key_numbers = convert_answer_key_cached(key_tuple, tuple(map(type, key_tuple)))
+    except TypeError:
+        # Unhashable entries can't be cached
+        answer_key_numbers = convert_answer_key_letters(answer_key)
+    return np.asarray(answer_key_numbers, dtype=np.int8)
+
+
+def calculate_score(student_answers, answer_key, num_subjects=5, questions_per_subject=20, return_arrays=False):
     """
     Calculate scores for each subject and total score
+    return_arrays: return the subject scores as an ndarray (and the total as a NumPy integer) instead of a list and int
+    Use calculate_score_debug for the diagnostic output
     """
-    # Convert answer key to numbers
-    answer_key_numbers = convert_answer_key_letters(answer_key)
+    total_expected_questions = num_subjects * questions_per_subject
     
+    # int8 copies padded with option A or truncated to the expected length (the caller's lists are never modified)
+    student_answers = fit_answers(np.asarray(student_answers, dtype=np.int8), total_expected_questions)
+    answer_key_numbers = fit_answers(answer_key_array(answer_key), total_expected_questions)
+    
+    # Compare all answers at once as (subject, question) grids, then sum each subject's row
+    student_grid = student_answers.reshape(num_subjects, questions_per_subject)
+    key_grid = answer_key_numbers.reshape(num_subjects, questions_per_subject)
+    subject_scores = (student_grid == key_grid).sum(axis=1)
+    
+    if return_arrays:
+        return subject_scores, subject_scores.sum()
+    
+    subject_scores = subject_scores.tolist()
+    return subject_scores, sum(subject_scores)
+
+
+def calculate_score_debug(student_answers, answer_key, num_subjects=5, questions_per_subject=20, return_arrays=False):
+    """
+    calculate_score with diagnostic prints of the inputs and the per-subject breakdown
+    """
     total_expected_questions = num_subjects * questions_per_subject
+    student_answers = np.asarray(student_answers, dtype=np.int8)
+    answer_key_numbers = answer_key_array(answer_key)
     
-    # Ensure both lists have the same length
+    # Report length mismatches, then pad or truncate like calculate_score does
     if len(student_answers) != total_expected_questions:
-        if debug:
-            print(f"Warning: Student answers length {len(student_answers)} != expected {total_expected_questions}")
-        # Pad or truncate student answers
-        while len(student_answers) < total_expected_questions:
-            student_answers.append(1)
-        student_answers = student_answers[:total_expected_questions]
-    
+        print(f"Warning: Student answers length {len(student_answers)} != expected {total_expected_questions}")
     if len(answer_key_numbers) != total_expected_questions:
-        if debug:
-            print(f"Warning: Answer key length {len(answer_key_numbers)} != expected {total_expected_questions}")
-        # Pad or truncate answer key
-        while len(answer_key_numbers) < total_expected_questions:
-            answer_key_numbers.append(1)
-        answer_key_numbers = answer_key_numbers[:total_expected_questions]
-    
-    subject_scores = []
-    
-    if debug:
-        print(f"Calculating scores for {num_subjects} subjects, {questions_per_subject} questions each")
-        print(f"Student answers sample: {student_answers[:10]}")
-        print(f"Answer key sample: {answer_key_numbers[:10]}")
-    
-    for subject_idx in range(num_subjects):
-        start_idx = subject_idx * questions_per_subject
-        end_idx = (subject_idx + 1) * questions_per_subject
-        
-        student_section = student_answers[start_idx:end_idx]
-        key_section = answer_key_numbers[start_idx:end_idx]
-        
-        # Count correct answers
-        correct_count = 0
-        for student_ans, correct_ans in zip(student_section, key_section):
-            if student_ans == correct_ans:
-                correct_count += 1
-        
-        subject_scores.append(correct_count)
-        
-        if debug:
-            print(f"Subject {subject_idx + 1}: {correct_count}/{questions_per_subject} correct")
-            if subject_idx == 0:  # Show details for first subject
-                print(f"  Student: {student_section}")
-                print(f"  Correct: {key_section}")
-    
-    total_score = sum(subject_scores)
-    
-    if debug:
-        print(f"Final scores: {subject_scores}, Total: {total_score}")
-    
-    return subject_scores, total_score
\ No newline at end of file
+        print(f"Warning: Answer key length {len(answer_key_numbers)} != expected {total_expected_questions}")
+    student_answers = fit_answers(student_answers, total_expected_questions)
+    answer_key_numbers = fit_answers(answer_key_numbers, total_expected_questions)
+    
+    print(f"Calculating scores for {num_subjects} subjects, {questions_per_subject} questions each")
+    print(f"Student answers sample: {student_answers[:10].tolist()}")
+    print(f"Answer key sample: {answer_key_numbers[:10].tolist()}")
+    
+    subject_scores, total_score = calculate_score(student_answers, answer_key_numbers, num_subjects, questions_per_subject, return_arrays)
+    
+    for subject_idx, correct_count in enumerate(subject_scores):
+        print(f"Subject {subject_idx + 1}: {correct_count}/{questions_per_subject} correct")
+        if subject_idx == 0:  # Show details for first subject
+            print(f"  Student: {student_answers[:questions_per_subject].tolist()}")
+            print(f"  Correct: {answer_key_numbers[:questions_per_subject].tolist()}")
+    
+    print(f"Final scores: {subject_scores}, Total: {total_score}")
+    
+    return subject_scores, total_score
+
+
+def calculate_scores_batch(student_answers_matrix, answer_key, num_subjects=5, questions_per_subject=20):
+    """
+    Calculate scores for many sheets in one pass
+    student_answers_matrix: one row of answers per sheet, as a list of lists (rows may differ in length)
+    or a 2D array; a single sheet may be passed as one flat list or 1D array
+    Returns (subject_scores, total_scores) arrays shaped (sheets, num_subjects) and (sheets,)
+    """
+    total_expected_questions = num_subjects * questions_per_subject
+    
+    # Convert answer key once for the whole batch
+    key = fit_answers(answer_key_array(answer_key), total_expected_questions)
+    
+    if isinstance(student_answers_matrix, (np.ndarray, np.generic)):
+        students = np.asarray(student_answers_matrix, dtype=np.int8)
+        if students.ndim not in (1, 2):
+            raise ValueError(f"Expected a 1D or 2D array of answers, got {students.ndim}D")
+        if students.ndim == 1:
+            # A single sheet; an empty array is an empty batch
+            students = students.reshape(1, -1) if students.size else students.reshape(0, 0)
+        students = fit_answers(students, total_expected_questions)
+    else:
+        rows = list(student_answers_matrix)
+        if rows and np.ndim(rows[0]) == 0:
+            # A single sheet as one flat list
+            rows = [rows]
+        # Pad or truncate each row before stacking, so rows of different lengths still line up
+        students = np.empty((len(rows), total_expected_questions), dtype=np.int8)
+        for i, row in enumerate(rows):
+            students[i] = fit_answers(np.asarray(row, dtype=np.int8), total_expected_questions)
+    
+    # Compare every sheet against the key at once, then sum each subject's questions
+    correct = (students == key).reshape(len(students), num_subjects, questions_per_subject)
+    subject_scores = correct.sum(axis=2)
+    
+    return subject_scores, subject_scores.sum(axis=1)
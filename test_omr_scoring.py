@@ -0,0 +1,24 @@
+# test_omr_scoring.py
+import numpy as np
+
+from omr_scoring import calculate_score
+
+
+def test_letter_ndarray_key():
+    """
+    Letter keys stored in an ndarray (str or object) are converted, not cast
+    """
+    student_answers = [1, 2, 3, 4] * 25
+
+    for key in (np.array(['a', 'b', 'c', 'd'] * 25), np.array(['a', 'b', 'c', 'd'] * 25, dtype=object)):
+        assert calculate_score(student_answers, key) == ([20, 20, 20, 20, 20], 100)
+
+
+def test_numeric_ndarray_key():
+    """
+    A numeric ndarray key scores the same as the equivalent letter list
+    """
+    student_answers = [1, 2, 3, 4] * 25
+    letter_key = ['a', 'b', 'c', 'c'] * 25
+
+    assert calculate_score(student_answers, np.array([1, 2, 3, 3] * 25)) == calculate_score(student_answers, letter_key)